@@ -10,22 +10,36 @@ from pathlib import Path
 from typing import List, Optional
 from datetime import datetime
 import asyncio
-
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import aiofiles
 from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse, HTMLResponse, JSONResponse
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 
-from olm_parser import OLMParser
+from olm_parser import OLMParser, new_process_pool
 from format_converters import (
     convert_to_csv,
     convert_to_txt,
     convert_to_json,
     convert_to_pdf,
-    convert_to_md
+    convert_to_md,
+    pdf_fields
 )
 
-app = FastAPI(title="OLM File Converter", version="1.0.0")
+# orjson keeps the frequently polled status endpoint cheap to serialize
+app = FastAPI(
+    title="OLM File Converter",
+    version="1.0.0",
+    default_response_class=ORJSONResponse
+)
 
 # Enable CORS
 app.add_middleware(
@@ -36,25 +50,185 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress text exports on the wire for clients that accept gzip. This runs
+# on the event loop, so use a middling level: level 9 costs several times
+# the CPU for a few percent smaller files, stalling other requests.
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=6)
+
 # Directories - Use /tmp for serverless environments
 UPLOAD_DIR = Path("/tmp/uploads")
 OUTPUT_DIR = Path("/tmp/outputs")
 UPLOAD_DIR.mkdir(exist_ok=True)
 OUTPUT_DIR.mkdir(exist_ok=True)
 
-# Store conversion status
-conversion_status = {}
+
+@dataclass(slots=True)
+class TaskStatus:
+    """Progress of a single conversion task, updated in place"""
+    status: str
+    progress: int = 0
+    message: str = ""
+    email_count: int = 0
+    files: List[dict] = field(default_factory=list)
+    expires_at: float = 0.0
+
+
+# Output format -> converter function
+CONVERTERS = {
+    "csv": convert_to_csv,
+    "txt": convert_to_txt,
+    "json": convert_to_json,
+    "pdf": convert_to_pdf,
+    "md": convert_to_md
+}
+VALID_FORMATS = frozenset(CONVERTERS)
+
+# Download content types, so text formats get gzipped in transit
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "txt": "text/plain",
+    "json": "application/json",
+    "pdf": "application/pdf",
+    "md": "text/markdown"
+}
+
+# Store conversion status, oldest first. Entries expire after STATUS_TTL
+# seconds and at most MAX_TASKS are kept, whether or not clients clean up.
+MAX_TASKS = 10000
+STATUS_TTL = 3600  # 1 hour, matching the file cleanup
+conversion_status: "OrderedDict[str, TaskStatus]" = OrderedDict()
+
+# PDF rendering is CPU-bound pure Python, so it runs in worker processes.
+# Created lazily so importing the app never spawns processes.
+pdf_pool = None
+
+# Large archives are parsed in worker processes. One pool serves every
+# upload, so concurrent uploads share a CPU's worth of processes instead of
+# each starting its own. Also created lazily.
+PARSE_WORKERS = os.cpu_count() or 1
+parse_pool = None
+parse_pool_lock = threading.Lock()
+
+# Parsing and the thread-based converters are CPU-bound, so they get a pool
+# sized to the machine. asyncio's default executor (also used by aiofiles
+# for upload writes) is left alone so I/O never queues behind conversions.
+cpu_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="olm")
 
 
 def cleanup_old_files():
     """Remove files older than 1 hour"""
-    current_time = datetime.now().timestamp()
+    current_time = time.time()
     for directory in [UPLOAD_DIR, OUTPUT_DIR]:
-        for file_path in directory.glob("*"):
-            if file_path.is_file():
-                file_age = current_time - file_path.stat().st_mtime
-                if file_age > 3600:  # 1 hour
-                    file_path.unlink()
+        # scandir reuses the stat data from the directory listing
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    file_age = current_time - entry.stat(follow_symlinks=False).st_mtime
+                    if file_age > 3600:  # 1 hour
+                        os.unlink(entry.path)
+                except FileNotFoundError:
+                    # Removed concurrently, e.g. by the cleanup endpoint
+                    continue
+
+
+def set_status(task_id: str, status: TaskStatus):
+    """Store a task status, evicting the oldest tasks beyond MAX_TASKS"""
+    status.expires_at = time.time() + STATUS_TTL
+    conversion_status[task_id] = status
+    conversion_status.move_to_end(task_id)
+    while len(conversion_status) > MAX_TASKS:
+        conversion_status.popitem(last=False)
+
+
+def expire_status():
+    """Drop status entries past their expiry time"""
+    now = time.time()
+    while conversion_status:
+        task_id, status = next(iter(conversion_status.items()))
+        if status.expires_at > now:
+            break
+        if status.status == "processing":
+            # Still running - keep it around for another TTL
+            set_status(task_id, status)
+        else:
+            del conversion_status[task_id]
+
+
+def _unlink_all(paths: List[Path]):
+    """Delete each file that exists"""
+    for path in paths:
+        path.unlink(missing_ok=True)
+
+
+async def remove_files(paths: List[Path]):
+    """Delete files without blocking the event loop on large unlinks"""
+    await asyncio.to_thread(_unlink_all, paths)
+
+
+def get_pdf_pool() -> Optional[ProcessPoolExecutor]:
+    """Return the PDF process pool, or None where processes are unavailable"""
+    global pdf_pool
+    if pdf_pool is None:
+        pdf_pool = new_process_pool(min(2, os.cpu_count() or 1)) or False
+    return pdf_pool or None
+
+
+def get_parse_pool() -> Optional[ProcessPoolExecutor]:
+    """Return the shared parsing pool, or None where processes are unavailable"""
+    global parse_pool
+    # Parses start on several cpu_pool threads at once
+    with parse_pool_lock:
+        if parse_pool is None:
+            pool = new_process_pool(PARSE_WORKERS) if PARSE_WORKERS > 1 else None
+            # False: no pool here - don't try again for every upload
+            parse_pool = pool or False
+    return parse_pool or None
+
+
+def parse_upload(file_path: Path) -> List[dict]:
+    """Parse an uploaded OLM file, in the shared worker pool when there is one"""
+    global parse_pool
+    pool = get_parse_pool()
+    parser = OLMParser(file_path, workers=PARSE_WORKERS if pool else 1, executor=pool)
+    try:
+        return parser.parse()
+    except Exception as e:
+        if pool is None or not isinstance(e.__cause__, BrokenProcessPool):
+            raise
+        # A worker died (e.g. killed for memory). Start a fresh pool for
+        # later uploads and parse this one in-process.
+        with parse_pool_lock:
+            if parse_pool is pool:
+                parse_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        return OLMParser(file_path, workers=1).parse()
+    finally:
+        parser.cleanup()
+
+
+async def run_converter(converter, emails: List[dict], output_path: Path):
+    """Run a converter off the event loop"""
+    loop = asyncio.get_running_loop()
+    if converter is convert_to_pdf:
+        pool = get_pdf_pool()
+        if pool is not None:
+            # Only what the PDF shows is pickled over to the worker, not
+            # every full body in the mailbox. The trimmed copy is built on
+            # cpu_pool too - on big mailboxes it takes a while.
+            trimmed = await loop.run_in_executor(cpu_pool, pdf_fields, emails)
+            try:
+                return await loop.run_in_executor(pool, converter, trimmed, output_path)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory). Start a fresh pool
+                # for later conversions and render this one in a thread.
+                global pdf_pool
+                if pdf_pool is pool:
+                    pdf_pool = None
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    return await loop.run_in_executor(cpu_pool, converter, emails, output_path)
 
 
 async def process_olm_file(
@@ -63,93 +237,91 @@ async def process_olm_file(
     output_formats: List[str]
 ):
     """Process OLM file and convert to requested formats"""
-    try:
-        conversion_status[task_id] = {
-            "status": "processing",
-            "progress": 0,
-            "message": "Extracting OLM file..."
-        }
+    status = TaskStatus("processing", message="Extracting OLM file...")
+    set_status(task_id, status)
 
+    try:
         # Parse OLM file
-        parser = OLMParser(file_path)
-        conversion_status[task_id]["progress"] = 20
-        conversion_status[task_id]["message"] = "Parsing emails..."
+        status.progress = 20
+        status.message = "Parsing emails..."
 
-        emails = await asyncio.to_thread(parser.parse)
+        emails = await asyncio.get_running_loop().run_in_executor(cpu_pool, parse_upload, file_path)
 
         if not emails:
-            conversion_status[task_id] = {
-                "status": "error",
-                "message": "No emails found in OLM file"
-            }
+            status.status = "error"
+            status.message = "No emails found in OLM file"
+            set_status(task_id, status)
             return
 
-        conversion_status[task_id]["progress"] = 50
-        conversion_status[task_id]["message"] = f"Found {len(emails)} emails. Converting..."
+        status.progress = 50
+        status.message = f"Found {len(emails)} emails. Converting..."
 
-        # Convert to requested formats
-        output_files = []
+        # Convert to requested formats concurrently - the converters share
+        # no state, so total time approaches the slowest format
         progress_per_format = 50 / len(output_formats)
 
-        for idx, fmt in enumerate(output_formats):
-            output_path = OUTPUT_DIR / f"{task_id}.{fmt}"
+        tasks = [
+            run_converter(CONVERTERS[fmt], emails, OUTPUT_DIR / f"{task_id}.{fmt}")
+            for fmt in output_formats
+        ]
+        for idx, task in enumerate(asyncio.as_completed(tasks)):
+            await task
+            status.progress = 50 + int((idx + 1) * progress_per_format)
 
-            if fmt == "csv":
-                await asyncio.to_thread(convert_to_csv, emails, output_path)
-            elif fmt == "txt":
-                await asyncio.to_thread(convert_to_txt, emails, output_path)
-            elif fmt == "json":
-                await asyncio.to_thread(convert_to_json, emails, output_path)
-            elif fmt == "pdf":
-                await asyncio.to_thread(convert_to_pdf, emails, output_path)
-            elif fmt == "md":
-                await asyncio.to_thread(convert_to_md, emails, output_path)
-
-            output_files.append({
+        for fmt in output_formats:
+            output_path = OUTPUT_DIR / f"{task_id}.{fmt}"
+            status.files.append({
                 "format": fmt,
                 "filename": f"{task_id}.{fmt}",
                 "size": output_path.stat().st_size
             })
 
-            conversion_status[task_id]["progress"] = 50 + int((idx + 1) * progress_per_format)
-
-        conversion_status[task_id] = {
-            "status": "completed",
-            "progress": 100,
-            "message": f"Successfully converted {len(emails)} emails",
-            "email_count": len(emails),
-            "files": output_files
-        }
+        status.status = "completed"
+        status.progress = 100
+        status.message = f"Successfully converted {len(emails)} emails"
+        status.email_count = len(emails)
+        set_status(task_id, status)
 
         # Cleanup
-        parser.cleanup()
-        if file_path.exists():
-            file_path.unlink()
+        await remove_files([file_path])
 
     except Exception as e:
-        conversion_status[task_id] = {
-            "status": "error",
-            "message": str(e)
-        }
-        if file_path.exists():
-            file_path.unlink()
+        status.status = "error"
+        status.message = str(e)
+        set_status(task_id, status)
+        await remove_files([file_path])
+
+
+# Try multiple paths for different deployment environments
+HTML_PATHS = [
+    Path("static/index.html"),
+    Path(__file__).parent / "static" / "index.html",
+    Path("/var/task/static/index.html")
+]
+
+# Contents of index.html, read on the first request and then reused
+index_html = None
+
+
+def load_index_html() -> Optional[str]:
+    """Read the main HTML page from the first location that has it"""
+    for html_path in HTML_PATHS:
+        if html_path.exists():
+            with open(html_path, "r") as f:
+                return f.read()
+    return None
 
 
 @app.get("/", response_class=HTMLResponse)
 async def root():
     """Serve the main HTML page"""
+    global index_html
     try:
-        # Try multiple paths for different deployment environments
-        html_paths = [
-            Path("static/index.html"),
-            Path(__file__).parent / "static" / "index.html",
-            Path("/var/task/static/index.html")
-        ]
+        if index_html is None:
+            index_html = load_index_html()
 
-        for html_path in html_paths:
-            if html_path.exists():
-                with open(html_path, "r") as f:
-                    return f.read()
+        if index_html is not None:
+            return HTMLResponse(index_html)
 
         # If no HTML file found, return a simple page
         return """
@@ -197,10 +369,9 @@ async def upload_olm(
     if not file.filename.lower().endswith('.olm'):
         raise HTTPException(400, "Only .olm files are supported")
 
-    # Parse requested formats
-    output_formats = [f.strip().lower() for f in formats.split(",")]
-    valid_formats = {"csv", "txt", "json", "pdf", "md"}
-    output_formats = [f for f in output_formats if f in valid_formats]
+    # Parse requested formats, dropping unknown ones and duplicates
+    requested = (f.strip().lower() for f in formats.split(","))
+    output_formats = list(dict.fromkeys(f for f in requested if f in VALID_FORMATS))
 
     if not output_formats:
         raise HTTPException(400, "No valid output formats specified")
@@ -209,15 +380,23 @@ async def upload_olm(
     task_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
     file_path = UPLOAD_DIR / f"{task_id}.olm"
 
-    # Save uploaded file
+    # Save uploaded file. Writes go through aiofiles so they don't block the
+    # event loop, and the file only gets its final name once complete.
+    partial_path = file_path.with_suffix(".part")
     try:
-        with open(file_path, "wb") as buffer:
+        async with aiofiles.open(partial_path, "wb") as buffer:
             # Read in chunks for large files
             while chunk := await file.read(1024 * 1024 * 10):  # 10MB chunks
-                buffer.write(chunk)
+                await buffer.write(chunk)
+        os.replace(partial_path, file_path)
     except Exception as e:
+        if partial_path.exists():
+            partial_path.unlink()
         raise HTTPException(500, f"Failed to save file: {str(e)}")
 
+    # Forget stale tasks before registering a new one
+    expire_status()
+
     # Start background processing
     background_tasks.add_task(process_olm_file, file_path, task_id, output_formats)
 
@@ -237,7 +416,15 @@ async def get_status(task_id: str):
     if task_id not in conversion_status:
         raise HTTPException(404, "Task not found")
 
-    return conversion_status[task_id]
+    # expires_at is internal bookkeeping, not part of the API
+    status = conversion_status[task_id]
+    return {
+        "status": status.status,
+        "progress": status.progress,
+        "message": status.message,
+        "email_count": status.email_count,
+        "files": status.files
+    }
 
 
 @app.get("/api/download/{task_id}/{format}")
@@ -248,10 +435,16 @@ async def download_file(task_id: str, format: str):
     if not file_path.exists():
         raise HTTPException(404, "File not found")
 
+    headers = None
+    if format == "pdf":
+        # PDF streams are already compressed - keep GZipMiddleware off them
+        headers = {"Content-Encoding": "identity"}
+
     return FileResponse(
         path=file_path,
         filename=f"converted_emails.{format}",
-        media_type="application/octet-stream"
+        media_type=MEDIA_TYPES.get(format, "application/octet-stream"),
+        headers=headers
     )
 
 
@@ -259,14 +452,10 @@ async def download_file(task_id: str, format: str):
 async def cleanup_task(task_id: str):
     """Clean up task files"""
     # Remove output files
-    for ext in ["csv", "txt", "json", "pdf", "md"]:
-        file_path = OUTPUT_DIR / f"{task_id}.{ext}"
-        if file_path.exists():
-            file_path.unlink()
+    await remove_files([OUTPUT_DIR / f"{task_id}.{ext}" for ext in VALID_FORMATS])
 
     # Remove from status
-    if task_id in conversion_status:
-        del conversion_status[task_id]
+    conversion_status.pop(task_id, None)
 
     return {"message": "Cleanup completed"}
 
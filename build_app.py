@@ -32,10 +32,20 @@ def build_executable():
     print("\nBuilding executable...")
     print("This may take a few minutes...\n")
 
+    # --onedir keeps the libraries unpacked next to the executable instead of
+    # extracting a --onefile archive to a temp dir on every launch
+    options = []
+    upx_path = shutil.which("upx")
+    if upx_path:
+        options += ["--upx-dir", os.path.dirname(upx_path)]
+    if platform.system() != "Windows":
+        options.append("--strip")
+
     subprocess.check_call([
         sys.executable, "-m", "PyInstaller",
         "--clean",
-        "--onefile",
+        "--onedir",
+        *options,
         "--name", "OLM-Converter",
         "--add-data", f"static{os.pathsep}static",
         "--hidden-import", "uvicorn.logging",
@@ -51,6 +61,10 @@ def build_executable():
         "--hidden-import", "email.parser",
         "--hidden-import", "email.policy",
         "--hidden-import", "chardet",
+        "--exclude-module", "tkinter",
+        "--exclude-module", "matplotlib",
+        "--exclude-module", "IPython",
+        "--exclude-module", "PIL.ImageQt",
         "desktop_app.py"
     ])
 
@@ -80,22 +94,26 @@ def main():
     print("=" * 50)
     print()
 
-    dist_dir = os.path.join(os.path.dirname(__file__), "dist")
+    app_dir = os.path.join(os.path.dirname(__file__), "dist", "OLM-Converter")
     if platform.system() == "Windows":
         exe_name = "OLM-Converter.exe"
     else:
         exe_name = "OLM-Converter"
 
-    exe_path = os.path.join(dist_dir, exe_name)
+    exe_path = os.path.join(app_dir, exe_name)
 
     if os.path.exists(exe_path):
-        size_mb = os.path.getsize(exe_path) / (1024 * 1024)
+        size_mb = sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, files in os.walk(app_dir)
+            for name in files
+        ) / (1024 * 1024)
         print(f"Executable created: {exe_path}")
         print(f"Size: {size_mb:.1f} MB")
         print()
         print("You can now:")
-        print(f"  1. Copy '{exe_name}' anywhere on your computer")
-        print("  2. Double-click to run it")
+        print(f"  1. Copy the '{app_dir}' folder anywhere on your computer")
+        print(f"  2. Double-click '{exe_name}' inside it to run")
         print("  3. Your browser will open automatically")
     else:
         print("Error: Executable was not created. Check the output above for errors.")
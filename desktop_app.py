@@ -10,6 +10,7 @@ import webbrowser
 import threading
 import time
 import signal
+import multiprocessing
 
 # Ensure we can find our modules when running as executable
 if getattr(sys, 'frozen', False):
@@ -38,6 +39,9 @@ def open_browser():
 
 
 def main():
+    # Lets PDF worker processes start inside the frozen executable
+    multiprocessing.freeze_support()
+
     print("=" * 50)
     print("   OLM File Converter - Desktop Edition")
     print("=" * 50)
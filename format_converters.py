@@ -2,17 +2,36 @@
 Format Converters
 Convert parsed email data to various formats (CSV, TXT, JSON, PDF)
 """
+import base64
 import csv
-import json
+import html
+import tempfile
 from pathlib import Path
 from typing import List, Dict, Any
 from datetime import datetime
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Preformatted, Spacer, PageBreak
 from reportlab.lib.enums import TA_LEFT
-import pandas as pd
+from pypdf import PdfWriter
+import orjson
+
+
+_JSON_OPTIONS = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+
+# TXT export separators
+_SEP = "=" * 80 + "\n"
+_SUB = "-" * 80 + "\n"
+
+# Emails rendered per reportlab build before merging into the final PDF
+PDF_CHUNK_SIZE = 200
+# Characters per wrapped body line (8pt Courier across the 7.5in frame)
+PDF_BODY_LINE_LENGTH = 110
+# Longest body rendered in the PDF; longer ones are cut with a note
+PDF_MAX_BODY_CHARS = 5000
+# Email fields the PDF shows besides the body
+_PDF_FIELDS = ('subject', 'date', 'from', 'to', 'cc', 'attachments')
 
 
 def convert_to_csv(emails: List[Dict[str, Any]], output_path: Path):
@@ -21,25 +40,22 @@ def convert_to_csv(emails: List[Dict[str, Any]], output_path: Path):
 
     CSV columns: Date, From, To, CC, Subject, Body, Attachments
     """
-    with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
-        fieldnames = ['Date', 'From', 'To', 'CC', 'Subject', 'Body', 'Attachments']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+    with open(output_path, 'w', newline='', encoding='utf-8', buffering=1 << 20) as csvfile:
+        writer = csv.writer(csvfile)
 
-        writer.writeheader()
+        writer.writerow(('Date', 'From', 'To', 'CC', 'Subject', 'Body', 'Attachments'))
 
         for email in emails:
-            # Format attachments as comma-separated list
-            attachments = ', '.join(email.get('attachments', []))
-
-            writer.writerow({
-                'Date': email.get('date', ''),
-                'From': email.get('from', ''),
-                'To': email.get('to', ''),
-                'CC': email.get('cc', ''),
-                'Subject': email.get('subject', ''),
-                'Body': email.get('body', '').replace('\n', ' ').replace('\r', ''),
-                'Attachments': attachments
-            })
+            writer.writerow((
+                email.get('date', ''),
+                email.get('from', ''),
+                email.get('to', ''),
+                email.get('cc', ''),
+                email.get('subject', ''),
+                # Flatten the body onto a single line
+                email.get('body', '').replace('\n', ' ').replace('\r', ''),
+                _attachments_str(email)
+            ))
 
 
 def convert_to_txt(emails: List[Dict[str, Any]], output_path: Path):
@@ -48,71 +64,178 @@ def convert_to_txt(emails: List[Dict[str, Any]], output_path: Path):
 
     Each email is formatted as a readable text block with clear separators
     """
-    with open(output_path, 'w', encoding='utf-8') as txtfile:
-        txtfile.write("=" * 80 + "\n")
-        txtfile.write(f"EMAIL EXPORT - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        txtfile.write(f"Total Emails: {len(emails)}\n")
-        txtfile.write("=" * 80 + "\n\n")
+    with open(output_path, 'w', encoding='utf-8', buffering=1 << 20) as txtfile:
+        txtfile.write(
+            f"{_SEP}"
+            f"EMAIL EXPORT - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+            f"Total Emails: {len(emails)}\n"
+            f"{_SEP}\n"
+        )
 
         for idx, email in enumerate(emails, 1):
-            txtfile.write(f"\n{'=' * 80}\n")
-            txtfile.write(f"EMAIL #{idx}\n")
-            txtfile.write(f"{'=' * 80}\n\n")
-
-            txtfile.write(f"Date:    {email.get('date', 'N/A')}\n")
-            txtfile.write(f"From:    {email.get('from', 'N/A')}\n")
-            txtfile.write(f"To:      {email.get('to', 'N/A')}\n")
+            # Assemble the whole block and write it in one call
+            parts = [
+                f"\n{_SEP}",
+                f"EMAIL #{idx}\n",
+                f"{_SEP}\n",
+                f"Date:    {email.get('date', 'N/A')}\n",
+                f"From:    {email.get('from', 'N/A')}\n",
+                f"To:      {email.get('to', 'N/A')}\n",
+            ]
 
             if email.get('cc'):
-                txtfile.write(f"CC:      {email.get('cc')}\n")
+                parts.append(f"CC:      {email.get('cc')}\n")
 
-            txtfile.write(f"Subject: {email.get('subject', '(No Subject)')}\n")
+            parts.append(f"Subject: {email.get('subject', '(No Subject)')}\n")
 
-            if email.get('attachments'):
-                txtfile.write(f"Attachments: {', '.join(email.get('attachments'))}\n")
+            attachments_str = _attachments_str(email)
+            if attachments_str:
+                parts.append(f"Attachments: {attachments_str}\n")
 
-            txtfile.write(f"\n{'-' * 80}\n")
-            txtfile.write("MESSAGE BODY:\n")
-            txtfile.write(f"{'-' * 80}\n\n")
+            parts.append(f"\n{_SUB}MESSAGE BODY:\n{_SUB}\n")
+            parts.append(email.get('body', '(No content)'))
+            parts.append("\n\n")
 
-            body = email.get('body', '(No content)')
-            txtfile.write(body)
-            txtfile.write("\n\n")
+            txtfile.write(''.join(parts))
 
-        txtfile.write(f"\n{'=' * 80}\n")
-        txtfile.write(f"END OF EXPORT - {len(emails)} emails processed\n")
-        txtfile.write(f"{'=' * 80}\n")
+        txtfile.write(
+            f"\n{_SEP}"
+            f"END OF EXPORT - {len(emails)} emails processed\n"
+            f"{_SEP}"
+        )
 
 
 def convert_to_json(emails: List[Dict[str, Any]], output_path: Path):
     """
     Convert emails to JSON format
 
-    Creates a structured JSON with metadata and full email data
+    Creates a structured JSON with metadata and full email data.
+    Attachment contents, present when the parser was asked to decode them,
+    are written as base64 strings.
+    Emails are serialized one at a time straight to the file, so no
+    copy of the email list is held in memory.
     """
-    # Convert date objects to strings for JSON serialization
-    emails_serializable = []
-    for email in emails:
-        email_copy = email.copy()
-        if 'date_parsed' in email_copy and email_copy['date_parsed']:
-            email_copy['date_parsed'] = email_copy['date_parsed'].isoformat()
-        emails_serializable.append(email_copy)
-
-    output = {
-        'export_date': datetime.now().isoformat(),
-        'total_emails': len(emails),
-        'emails': emails_serializable
-    }
+    with open(output_path, 'wb', buffering=1024 * 1024) as jsonfile:
+        jsonfile.write(b'{\n  "export_date": ')
+        jsonfile.write(orjson.dumps(datetime.now()))
+        jsonfile.write(b',\n  "total_emails": ')
+        jsonfile.write(orjson.dumps(len(emails)))
+        jsonfile.write(b',\n  "emails": [')
+
+        for idx, email in enumerate(emails):
+            if idx:
+                jsonfile.write(b',')
+            jsonfile.write(b'\n')
+            # orjson serializes the date_parsed datetime natively (ISO 8601)
+            jsonfile.write(orjson.dumps(email, default=_json_default, option=_JSON_OPTIONS))
+
+        jsonfile.write(b'\n  ]\n}\n')
 
-    with open(output_path, 'w', encoding='utf-8') as jsonfile:
-        json.dump(output, jsonfile, indent=2, ensure_ascii=False)
+
+def _json_default(obj: Any) -> Any:
+    """Fallback for values orjson can't serialize natively"""
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        # Attachment contents ('attachment_data') become base64 strings
+        return base64.b64encode(obj).decode('ascii')
+    return str(obj)
 
 
 def convert_to_pdf(emails: List[Dict[str, Any]], output_path: Path):
     """
     Convert emails to PDF format
 
-    Creates a formatted PDF document with all emails
+    Creates a formatted PDF document with all emails. Large exports are
+    rendered in chunks of PDF_CHUNK_SIZE emails and merged afterwards, so
+    reportlab never holds more than one chunk of flowables in memory.
+    """
+    styles = _pdf_styles()
+
+    if len(emails) <= PDF_CHUNK_SIZE:
+        _build_pdf_chunk(emails, output_path, 1, len(emails), styles)
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        writer = PdfWriter()
+
+        for start in range(0, len(emails), PDF_CHUNK_SIZE):
+            chunk_path = Path(temp_dir) / f"chunk_{start}.pdf"
+            _build_pdf_chunk(
+                emails[start:start + PDF_CHUNK_SIZE],
+                chunk_path,
+                start + 1,
+                len(emails),
+                styles
+            )
+            writer.append(str(chunk_path))
+
+        with open(output_path, 'wb') as pdffile:
+            writer.write(pdffile)
+
+
+def pdf_fields(emails: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    The parts of each email that convert_to_pdf renders
+
+    For handing emails to another process: bodies are cut one character
+    past PDF_MAX_BODY_CHARS, so they are still marked as truncated, and
+    nothing the PDF doesn't show is copied.
+    """
+    trimmed = []
+    for email in emails:
+        fields = {key: email[key] for key in _PDF_FIELDS if key in email}
+        if 'body' in email:
+            fields['body'] = email['body'][:PDF_MAX_BODY_CHARS + 1]
+        trimmed.append(fields)
+    return trimmed
+
+
+def _pdf_styles() -> Dict[str, ParagraphStyle]:
+    """Paragraph styles shared by every PDF chunk"""
+    styles = getSampleStyleSheet()
+
+    return {
+        'title': ParagraphStyle(
+            'CustomTitle',
+            parent=styles['Heading1'],
+            fontSize=16,
+            textColor='#1a1a1a',
+            spaceAfter=12
+        ),
+        'header': ParagraphStyle(
+            'CustomHeader',
+            parent=styles['Normal'],
+            fontSize=10,
+            textColor='#333333',
+            spaceAfter=6
+        ),
+        # Monospaced so PDF_BODY_LINE_LENGTH characters fit the frame width
+        'body': ParagraphStyle(
+            'CustomBody',
+            parent=styles['Normal'],
+            fontName='Courier',
+            fontSize=8,
+            leading=10,
+            textColor='#1a1a1a',
+            alignment=TA_LEFT,
+            spaceAfter=12
+        ),
+    }
+
+
+def _build_pdf_chunk(
+    emails: List[Dict[str, Any]],
+    output_path: Path,
+    start_idx: int,
+    total: int,
+    styles: Dict[str, ParagraphStyle]
+):
+    """
+    Render one run of emails to its own PDF
+
+    start_idx is the number of the first email in the chunk; the chunk
+    starting at 1 also carries the export title.
     """
     doc = SimpleDocTemplate(
         str(output_path),
@@ -123,50 +246,28 @@ def convert_to_pdf(emails: List[Dict[str, Any]], output_path: Path):
         bottomMargin=0.5*inch
     )
 
-    # Styles
-    styles = getSampleStyleSheet()
-
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=16,
-        textColor='#1a1a1a',
-        spaceAfter=12
-    )
-
-    header_style = ParagraphStyle(
-        'CustomHeader',
-        parent=styles['Normal'],
-        fontSize=10,
-        textColor='#333333',
-        spaceAfter=6
-    )
-
-    body_style = ParagraphStyle(
-        'CustomBody',
-        parent=styles['Normal'],
-        fontSize=9,
-        textColor='#1a1a1a',
-        alignment=TA_LEFT,
-        spaceAfter=12
-    )
+    title_style = styles['title']
+    header_style = styles['header']
+    body_style = styles['body']
 
     # Build PDF content
     story = []
 
     # Title page
-    title = Paragraph(f"Email Export - {len(emails)} Messages", title_style)
-    story.append(title)
+    if start_idx == 1:
+        title = Paragraph(f"Email Export - {total} Messages", title_style)
+        story.append(title)
 
-    export_date = Paragraph(
-        f"Exported: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-        header_style
-    )
-    story.append(export_date)
-    story.append(Spacer(1, 0.25*inch))
+        export_date = Paragraph(
+            f"Exported: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+            header_style
+        )
+        story.append(export_date)
+        story.append(Spacer(1, 0.25*inch))
 
     # Add each email
-    for idx, email in enumerate(emails, 1):
+    last_idx = start_idx + len(emails) - 1
+    for idx, email in enumerate(emails, start_idx):
         # Email header
         subject = email.get('subject', '(No Subject)')
         subject_text = f"<b>Email #{idx}: {_escape_html(subject)}</b>"
@@ -182,8 +283,8 @@ def convert_to_pdf(emails: List[Dict[str, Any]], output_path: Path):
         if email.get('cc'):
             metadata_lines.append(f"<b>CC:</b> {_escape_html(email.get('cc'))}")
 
-        if email.get('attachments'):
-            attachments_str = ', '.join(email.get('attachments'))
+        attachments_str = _attachments_str(email)
+        if attachments_str:
             metadata_lines.append(f"<b>Attachments:</b> {_escape_html(attachments_str)}")
 
         for line in metadata_lines:
@@ -193,16 +294,17 @@ def convert_to_pdf(emails: List[Dict[str, Any]], output_path: Path):
 
         # Email body
         body = email.get('body', '(No content)')
-        # Truncate very long bodies and escape HTML
-        if len(body) > 5000:
-            body = body[:5000] + "\n\n[... Content truncated for PDF ...]"
+        # Truncate very long bodies
+        if len(body) > PDF_MAX_BODY_CHARS:
+            body = body[:PDF_MAX_BODY_CHARS] + "\n\n[... Content truncated for PDF ...]"
 
-        body_escaped = _escape_html(body)
-        body_para = Paragraph(body_escaped.replace('\n', '<br/>'), body_style)
+        # Preformatted lays out raw text without Paragraph's markup parser,
+        # so the body needs no escaping or <br/> substitution
+        body_para = Preformatted(body, body_style, maxLineLength=PDF_BODY_LINE_LENGTH)
         story.append(body_para)
 
         # Add page break between emails (except last one)
-        if idx < len(emails):
+        if idx < last_idx:
             story.append(PageBreak())
 
     # Build PDF
@@ -259,6 +361,12 @@ def convert_to_md(emails: List[Dict[str, Any]], output_path: Path):
         mdfile.write(f"\n**End of Export** - {len(emails)} emails processed\n")
 
 
+def _attachments_str(email: Dict[str, Any]) -> str:
+    """Attachment names as a comma-separated list, '' when there are none"""
+    attachments = email.get('attachments')
+    return ', '.join(attachments) if attachments else ""
+
+
 def _escape_markdown(text: str) -> str:
     """Escape Markdown special characters"""
     if not text:
@@ -285,11 +393,4 @@ def _escape_html(text: str) -> str:
     if not text:
         return ""
 
-    text = str(text)
-    text = text.replace('&', '&amp;')
-    text = text.replace('<', '&lt;')
-    text = text.replace('>', '&gt;')
-    text = text.replace('"', '&quot;')
-    text = text.replace("'", '&#39;')
-
-    return text
+    return html.escape(str(text), quote=True)
@@ -27,7 +27,6 @@ a = Analysis(
         'email.parser',
         'email.policy',
         'chardet',
-        'pandas',
         'reportlab',
         'reportlab.lib',
         'reportlab.platypus',
@@ -37,7 +36,12 @@ a = Analysis(
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    excludes=[
+        'tkinter',
+        'matplotlib',
+        'IPython',
+        'PIL.ImageQt',
+    ],
     win_no_prefer_redirects=False,
     win_private_assemblies=False,
     cipher=block_cipher,
@@ -46,20 +50,18 @@ a = Analysis(
 
 pyz = PYZ(a.pure, a.zipped_data, cipher=block_cipher)
 
+# One-folder build: libraries stay unpacked beside the executable so they
+# are not extracted to a temp dir on every launch
 exe = EXE(
     pyz,
     a.scripts,
-    a.binaries,
-    a.zipfiles,
-    a.datas,
     [],
+    exclude_binaries=True,
     name='OLM-Converter',
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
     upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
     console=True,  # Set to False for no console window on Windows
     disable_windowed_traceback=False,
     argv_emulation=False,
@@ -68,3 +70,14 @@ exe = EXE(
     entitlements_file=None,
     icon=None,  # Add icon path here if you have one
 )
+
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.zipfiles,
+    a.datas,
+    strip=False,
+    upx=True,
+    upx_exclude=[],
+    name='OLM-Converter',
+)
@@ -2,28 +2,108 @@
 OLM File Parser
 Extracts email data from Outlook for Mac (.olm) files
 """
+import functools
+import io
+import itertools
+import logging
+import multiprocessing
 import os
+import sys
+import threading
 import zipfile
-import tempfile
-import shutil
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional, BinaryIO, Tuple, Union
 import xml.etree.ElementTree as ET
 from datetime import datetime
 import email
 from email import policy
+from email.message import Message
 from email.parser import BytesParser
 import base64
+import binascii
 import chardet
 
 
+logger = logging.getLogger(__name__)
+
+# Parse failures kept in OLMParser.parse_errors
+MAX_RECORDED_ERRORS = 100
+
+# Shared .eml parser - it only holds configuration, so one instance can
+# parse any number of messages. compat32 keeps header values raw instead of
+# building structured header objects for every one of them; the handful of
+# headers we keep are then decoded with policy.default, by _header.
+_EML_PARSER = BytesParser(policy=policy.compat32)
+
+# Sender/recipient values shorter than this are interned: mailboxes repeat
+# the same few correspondents, so each distinct string is stored once
+MAX_INTERNED_LENGTH = 200
+
+# Bytes of an undeclared body that chardet looks at
+DETECT_SAMPLE_BYTES = 16 * 1024
+
+# Detected encodings are remembered per (body prefix, sender domain):
+# newsletters and mailing lists repeat both, and always use one encoding
+DETECT_KEY_BYTES = 256
+DETECT_CACHE_SIZE = 4096
+_detected_encodings: "OrderedDict[Tuple[bytes, str], str]" = OrderedDict()
+# Bodies are parsed from several threads at once
+_detected_lock = threading.Lock()
+
+# Substrings that identify the XML tags holding each email field, in priority
+# order, plus the fields that can be filled from XML messages
+_XML_KEYWORDS = ('subject', 'from', 'to', 'date', 'body')
+_XML_FIELDS = _XML_KEYWORDS + ('cc',)
+
+# Archive trees and file names that never contain mail: macOS resource
+# forks (whose ._message_*.xml shadows would otherwise be parsed), Finder
+# metadata, and the exported address book, calendar and tasks
+_SKIP_PREFIXES = ('__MACOSX/', 'Contacts/', 'Calendar/', 'Tasks/')
+_SKIP_NAMES = frozenset({'.DS_Store'})
+
+# Archives with fewer email entries than this are parsed in-process, where
+# starting worker processes would cost more than it saves
+PARALLEL_MIN_ENTRIES = 256
+# Entries handed to a worker process at a time
+PARALLEL_CHUNK_SIZE = 32
+# ...and at most this many uncompressed bytes, unless a single entry is larger
+PARALLEL_CHUNK_BYTES = 8 * 1024 * 1024
+
+
 class OLMParser:
     """Parser for OLM (Outlook for Mac) files"""
 
-    def __init__(self, olm_path: Path):
+    def __init__(
+        self,
+        olm_path: Path,
+        workers: Optional[int] = None,
+        decode_attachments: bool = False,
+        headers_only: bool = False,
+        max_body_bytes: Optional[int] = None,
+        executor: Optional[ProcessPoolExecutor] = None
+    ):
         self.olm_path = Path(olm_path)
-        self.temp_dir = None
+        # Worker processes for parsing large archives (default: one per CPU)
+        self.workers = workers or os.cpu_count() or 1
+        # Long-lived pool from new_process_pool() to parse in, shared with
+        # other parsers; without one, a pool of `workers` processes is
+        # started for each large archive
+        self.executor = executor
+        # Also keep attachment contents, as 'attachment_data' (bytes) alongside
+        # the 'attachments' names. Off by default. The JSON export writes
+        # them base64-encoded; the other formats only list the names.
+        self.decode_attachments = decode_attachments
+        # Read only the headers of .eml messages, leaving body and
+        # attachments empty - for indexing, where only metadata is needed
+        self.headers_only = headers_only
+        # Decode at most this many bytes of each .eml body (None: all of it)
+        self.max_body_bytes = max_body_bytes
         self.emails = []
+        # Entries that failed to parse: a total plus the most recent few
+        self.parse_failures = 0
+        self.parse_errors = deque(maxlen=MAX_RECORDED_ERRORS)
 
     def parse(self) -> List[Dict[str, Any]]:
         """
@@ -32,79 +112,241 @@ class OLMParser:
         Returns:
             List of email dictionaries with metadata and content
         """
-        # Create temporary directory
-        self.temp_dir = tempfile.mkdtemp()
-
         try:
-            # OLM files are actually ZIP archives
-            self._extract_olm()
-
-            # Find and parse email files
-            self._parse_emails()
-
+            self.emails = list(self.iter_emails())
             return self.emails
 
         except Exception as e:
-            raise Exception(f"Error parsing OLM file: {str(e)}")
+            raise Exception(f"Error parsing OLM file: {str(e)}") from e
 
-    def _extract_olm(self):
-        """Extract OLM file contents"""
-        try:
-            with zipfile.ZipFile(self.olm_path, 'r') as zip_ref:
-                zip_ref.extractall(self.temp_dir)
-        except zipfile.BadZipFile:
+    def iter_emails(self) -> Iterator[Dict[str, Any]]:
+        """
+        Yield email dictionaries one at a time as they are parsed
+
+        Consumers that process emails as they arrive only hold one in
+        memory; parse() collects them into a list.
+        """
+        if self.olm_path.is_dir():
             # Some OLM files might be directories, not zipped
-            if self.olm_path.is_dir():
-                shutil.copytree(self.olm_path, self.temp_dir, dirs_exist_ok=True)
+            source = self._iter_directory(self.olm_path)
+        elif zipfile.is_zipfile(self.olm_path):
+            # OLM files are actually ZIP archives
+            source = self._iter_zip()
+        else:
+            raise Exception("Invalid OLM file format")
+
+        for email_data in source:
+            yield _intern_addresses(email_data)
+
+        if self.parse_failures:
+            logger.warning(
+                "Skipped %d entries in %s that failed to parse",
+                self.parse_failures, self.olm_path
+            )
+
+    def _iter_zip(self) -> Iterator[Dict[str, Any]]:
+        """
+        Parse email entries straight out of the OLM archive
+
+        Entries are streamed from the ZIP instead of being extracted to a
+        temporary directory, so nothing is written to disk.
+        """
+        with zipfile.ZipFile(self.olm_path, 'r') as zip_ref:
+            # Sort the members by kind in one pass over the names. Directories
+            # and non-mail trees are skipped before anything is inflated.
+            by_kind = {'eml': [], 'xml': [], 'txt': []}
+            for info in zip_ref.infolist():
+                filename = info.filename
+                name = filename.rpartition('/')[2]
+                if not name or filename.startswith(_SKIP_PREFIXES) or _is_skipped_name(name):
+                    continue
+                kind = _entry_kind(name)
+                if kind:
+                    by_kind[kind].append(info)
+
+            # OLM structure typically contains .eml files or message XML files
+            # Look for .eml files (standard email format), then .xml message
+            # files (alternative OLM format)
+            entries = [('eml', info) for info in by_kind['eml']]
+            entries.extend(('xml', info) for info in by_kind['xml'])
+
+            # Entries are independent, so big archives are parsed across cores
+            executor = None
+            if len(entries) >= PARALLEL_MIN_ENTRIES and self.workers >= 2:
+                executor = self.executor or new_process_pool(self.workers)
+            if executor is not None:
+                found = yield from self._iter_entries_parallel(executor, zip_ref, entries)
             else:
-                raise Exception("Invalid OLM file format")
+                found = False
+                for kind, info in entries:
+                    # The entry is handed over as-is: ZipExtFile already
+                    # inflates into its own buffer and the parsers read in
+                    # blocks, while an extra read-ahead buffer would inflate
+                    # data that headers_only never looks at
+                    with zip_ref.open(info) as f:
+                        email_data = self._parse_one(self._parse_entry, (kind, f), info.filename)
+                    if email_data:
+                        found = True
+                        yield email_data
+
+            # If no emails found, try alternative parsing methods
+            if not found:
+                for info in by_kind['txt']:
+                    try:
+                        content = zip_ref.read(info).decode('utf-8', errors='ignore')
+                    except:
+                        continue
+                    email_data = _text_message(content, info.filename.rpartition('/')[2])
+                    if email_data:
+                        yield email_data
+
+    def _iter_entries_parallel(
+        self,
+        executor: ProcessPoolExecutor,
+        zip_ref: zipfile.ZipFile,
+        entries: List[Tuple[str, zipfile.ZipInfo]]
+    ):
+        """
+        Parse archive entries in worker processes, yielding in archive order
 
-    def _parse_emails(self):
-        """Parse all email files in the extracted OLM structure"""
-        temp_path = Path(self.temp_dir)
+        Entries are read from the archive here and parsed from memory by the
+        workers, so no worker process ever holds the file open - that would
+        keep a deleted upload's disk space in use, and on Windows stop it
+        being deleted at all. At most a few chunks per worker are in flight,
+        so parsed emails never pile up ahead of a slow consumer. Returns
+        whether any email was found.
+        """
+        found = False
+        options = {
+            'decode_attachments': self.decode_attachments,
+            'headers_only': self.headers_only,
+            'max_body_bytes': self.max_body_bytes
+        }
+        chunks = _chunk_entries(entries)
+        pending = deque(
+            self._submit_chunk(executor, zip_ref, options, chunk)
+            for chunk in itertools.islice(chunks, self.workers * 2)
+        )
+        try:
+            while pending:
+                names, future = pending.popleft()
+                results = future.result()
+                # Keep the workers busy while the caller handles this chunk
+                next_chunk = next(chunks, None)
+                if next_chunk is not None:
+                    pending.append(self._submit_chunk(executor, zip_ref, options, next_chunk))
 
-        # OLM structure typically contains .eml files or message XML files
-        # Look for .eml files (standard email format)
-        eml_files = list(temp_path.rglob("*.eml"))
+                for name, (email_data, error) in zip(names, results):
+                    if error:
+                        self._record_failure(name, error)
+                    elif email_data:
+                        found = True
+                        yield email_data
+        finally:
+            # Also reached when the caller stops early: drop queued chunks
+            # instead of parsing the rest of the archive
+            for _, future in pending:
+                future.cancel()
+            if executor is not self.executor:
+                executor.shutdown()
 
-        for eml_file in eml_files:
+        return found
+
+    def _submit_chunk(self, executor, zip_ref, options, chunk):
+        """Read a chunk of entries and queue it for a worker, returning (names, future)"""
+        names = []
+        items = []
+        for kind, info in chunk:
             try:
-                email_data = self._parse_eml_file(eml_file)
-                if email_data:
-                    self.emails.append(email_data)
+                with zip_ref.open(info) as f:
+                    # headers_only never looks past the header block
+                    if self.headers_only and kind == 'eml':
+                        data = _read_header_block(f)
+                    else:
+                        data = f.read()
             except Exception as e:
-                # Skip problematic emails but continue processing
-                print(f"Warning: Failed to parse {eml_file}: {str(e)}")
+                # Damaged entry - skip it but continue processing
+                self._record_failure(info.filename, e)
                 continue
+            names.append(info.filename)
+            items.append((kind, data))
+        return names, executor.submit(_parse_chunk_in_worker, options, items)
 
-        # Also look for .xml message files (alternative OLM format)
-        xml_files = list(temp_path.rglob("*.xml"))
-        for xml_file in xml_files:
-            if "message" in xml_file.name.lower():
-                try:
-                    email_data = self._parse_xml_message(xml_file)
-                    if email_data:
-                        self.emails.append(email_data)
-                except Exception as e:
-                    print(f"Warning: Failed to parse {xml_file}: {str(e)}")
-                    continue
+    def _parse_entry(self, entry: Tuple[str, BinaryIO]) -> Optional[Dict[str, Any]]:
+        """Parse an open archive entry of the given kind ('eml' or 'xml')"""
+        kind, f = entry
+        if kind == 'eml':
+            return self._parse_eml_file(f)
+        return self._parse_xml_message(f)
+
+    def _iter_directory(self, root: Path) -> Iterator[Dict[str, Any]]:
+        """Parse all email files in an unzipped OLM directory, in place"""
+        text_files = []
+        found = False
+
+        # OLM structure typically contains .eml files (standard email format)
+        # or message XML files (alternative OLM format). The tree is walked
+        # once and each file dispatched on its name.
+        for path, name in _iter_files(root):
+            kind = _entry_kind(name)
+            if kind == 'eml':
+                email_data = self._parse_one(self._parse_eml_path, path, path)
+            elif kind == 'xml':
+                email_data = self._parse_one(self._parse_xml_message, path, path)
+            else:
+                if kind == 'txt':
+                    text_files.append(path)
+                continue
+
+            if email_data:
+                found = True
+                yield email_data
 
         # If no emails found, try alternative parsing methods
-        if not self.emails:
-            self._parse_alternative_formats()
+        if not found:
+            yield from self._iter_alternative_formats(text_files)
 
-    def _parse_eml_file(self, eml_path: Path) -> Optional[Dict[str, Any]]:
-        """Parse a .eml (RFC 822) email file"""
+    def _parse_one(self, parse_func, source, name) -> Optional[Dict[str, Any]]:
+        """Parse one entry, returning None for entries that fail"""
+        try:
+            return parse_func(source)
+        except Exception as e:
+            # Skip problematic emails but continue processing
+            self._record_failure(name, e)
+            return None
+
+    def _record_failure(self, name, error):
+        """Note an entry that failed to parse; parse() logs a summary"""
+        self.parse_failures += 1
+        self.parse_errors.append((str(name), str(error)))
+        logger.debug("Failed to parse %s: %s", name, error)
+
+    def _parse_eml_path(self, eml_path: str) -> Optional[Dict[str, Any]]:
+        """Parse a .eml file on disk"""
         with open(eml_path, 'rb') as f:
-            msg = BytesParser(policy=policy.default).parse(f)
+            return self._parse_eml_file(f)
+
+    def _parse_eml_file(self, eml_file: BinaryIO) -> Optional[Dict[str, Any]]:
+        """Parse a .eml (RFC 822) email from an open binary file"""
+        if self.headers_only:
+            # Stop reading at the end of the header block, so the rest of
+            # the message is never read, let alone parsed
+            msg = _EML_PARSER.parsebytes(_read_header_block(eml_file), headersonly=True)
+        else:
+            # Parse straight from the stream: the feed parser consumes it in
+            # chunks, whereas reading the entry into bytes first would hold
+            # the whole message, attachments included, in memory several
+            # times over
+            msg = _EML_PARSER.parse(eml_file)
 
-        # Extract email data
+        # Extract email data as plain strings
+        headers = _raw_headers(msg)
         email_data = {
-            'subject': msg.get('Subject', '(No Subject)'),
-            'from': msg.get('From', ''),
-            'to': msg.get('To', ''),
-            'cc': msg.get('Cc', ''),
-            'date': msg.get('Date', ''),
+            'subject': _header(headers, 'subject', '(No Subject)'),
+            'from': _header(headers, 'from'),
+            'to': _header(headers, 'to'),
+            'cc': _header(headers, 'cc'),
+            'date': _header(headers, 'date'),
             'body': '',
             'attachments': []
         }
@@ -118,47 +360,75 @@ class OLMParser:
         except:
             email_data['date_parsed'] = None
 
+        if self.headers_only:
+            return email_data
+
         # Extract body
         if msg.is_multipart():
-            for part in msg.walk():
-                content_type = part.get_content_type()
-                content_disposition = str(part.get("Content-Disposition", ""))
-
-                # Get email body
-                if content_type == "text/plain" and "attachment" not in content_disposition:
-                    try:
-                        body = part.get_payload(decode=True)
-                        if body:
-                            # Detect encoding
-                            detected = chardet.detect(body)
-                            encoding = detected['encoding'] or 'utf-8'
-                            email_data['body'] = body.decode(encoding, errors='ignore')
-                    except:
-                        pass
+            # Get email body: the first text/plain part that isn't an
+            # attachment. Only that part is decoded.
+            body_part = next(
+                (
+                    part for part in msg.walk()
+                    if part.get_content_type() == "text/plain"
+                    and "attachment" not in str(part.get("Content-Disposition", ""))
+                ),
+                None
+            )
+            if body_part is not None:
+                try:
+                    body = body_part.get_payload(decode=True)
+                    if body:
+                        email_data['body'] = self._decode_body(body_part, body, email_data['from'])
+                except:
+                    pass
 
-                # Track attachments
-                elif "attachment" in content_disposition:
-                    filename = part.get_filename()
-                    if filename:
-                        email_data['attachments'].append(filename)
+            # Track attachments by name. Payloads are only decoded when
+            # asked for, as they usually make up most of the message.
+            attachments = [
+                (filename, part) for part in msg.walk()
+                if "attachment" in str(part.get("Content-Disposition", ""))
+                and (filename := _attachment_filename(part))
+            ]
+            email_data['attachments'] = [filename for filename, _ in attachments]
+            if self.decode_attachments:
+                email_data['attachment_data'] = [
+                    _attachment_payload(part) for _, part in attachments
+                ]
         else:
             try:
                 body = msg.get_payload(decode=True)
                 if body:
-                    detected = chardet.detect(body)
-                    encoding = detected['encoding'] or 'utf-8'
-                    email_data['body'] = body.decode(encoding, errors='ignore')
-            except:
-                email_data['body'] = str(msg.get_payload())
+                    email_data['body'] = self._decode_body(msg, body, email_data['from'])
+            except Exception as e:
+                # Keep the raw text if that's what the payload is; anything
+                # else (e.g. a list of parts) would stringify the whole message
+                payload = msg.get_payload()
+                email_data['body'] = payload if isinstance(payload, str) else ''
+                logger.debug("Could not decode body of %r: %s", email_data['subject'], e)
 
         return email_data
 
-    def _parse_xml_message(self, xml_path: Path) -> Optional[Dict[str, Any]]:
-        """Parse XML-formatted message file"""
-        try:
-            tree = ET.parse(xml_path)
-            root = tree.getroot()
+    def _decode_body(self, part: Message, body: bytes, sender: str) -> str:
+        """Decode a body payload using its declared charset when that's usable"""
+        if self.max_body_bytes is not None:
+            # A multi-byte character cut in half is dropped by errors='ignore'
+            body = body[:self.max_body_bytes]
+
+        charset = part.get_content_charset()
+        # 8-bit bodies labelled as ASCII are common; treat them as undeclared
+        if charset and not (charset in ('us-ascii', 'ascii') and not body.isascii()):
+            try:
+                return body.decode(charset, errors='ignore')
+            except LookupError:
+                # Unknown charset name - fall back to detection
+                pass
+
+        return _decode_undeclared(body, sender)
 
+    def _parse_xml_message(self, xml_source: Union[Path, BinaryIO]) -> Optional[Dict[str, Any]]:
+        """Parse XML-formatted message from a path or open binary file"""
+        try:
             email_data = {
                 'subject': '',
                 'from': '',
@@ -168,49 +438,239 @@ class OLMParser:
                 'body': '',
                 'attachments': []
             }
+            remaining = len(_XML_FIELDS)
 
-            # Extract data from XML (structure varies)
-            for elem in root.iter():
-                tag_lower = elem.tag.lower()
-                if 'subject' in tag_lower and elem.text:
-                    email_data['subject'] = elem.text
-                elif 'from' in tag_lower and elem.text:
-                    email_data['from'] = elem.text
-                elif 'to' in tag_lower and elem.text:
-                    email_data['to'] = elem.text
-                elif 'date' in tag_lower and elem.text:
-                    email_data['date'] = elem.text
-                elif 'body' in tag_lower and elem.text:
-                    email_data['body'] = elem.text
+            # Extract data from XML (structure varies). Elements are streamed
+            # and discarded once inspected, and parsing stops as soon as every
+            # field has a value.
+            for _, elem in ET.iterparse(xml_source, events=('end',)):
+                field = _xml_field(elem.tag)
+                if field and elem.text and not email_data[field]:
+                    email_data[field] = elem.text
+                    remaining -= 1
+                    if not remaining:
+                        break
+                elem.clear()
 
             return email_data if email_data['subject'] or email_data['body'] else None
 
         except:
             return None
 
-    def _parse_alternative_formats(self):
+    def _iter_alternative_formats(self, text_files: List[str]) -> Iterator[Dict[str, Any]]:
         """Try alternative parsing methods for different OLM formats"""
-        temp_path = Path(self.temp_dir)
-
         # Look for any text files that might contain email data
-        for text_file in temp_path.rglob("*.txt"):
+        for text_file in text_files:
             try:
                 with open(text_file, 'r', encoding='utf-8', errors='ignore') as f:
                     content = f.read()
-                    if len(content) > 50:  # Reasonable email length
-                        self.emails.append({
-                            'subject': f'Message from {text_file.name}',
-                            'from': '',
-                            'to': '',
-                            'cc': '',
-                            'date': '',
-                            'body': content,
-                            'attachments': []
-                        })
             except:
                 continue
+            email_data = _text_message(content, os.path.basename(text_file))
+            if email_data:
+                yield email_data
 
     def cleanup(self):
-        """Remove temporary files"""
-        if self.temp_dir and os.path.exists(self.temp_dir):
-            shutil.rmtree(self.temp_dir)
+        """
+        Release parser resources
+
+        Nothing is extracted to disk any more, so there is nothing to
+        remove; kept so callers can keep calling it after parse().
+        """
+
+
+def _raw_headers(msg: Message) -> Dict[str, Tuple[str, str]]:
+    """The first raw (name, value) of each header, by lowercase name"""
+    headers = {}
+    for name, value in msg.raw_items():
+        headers.setdefault(name.lower(), (name, value))
+    return headers
+
+
+def _header(raw_headers: Dict[str, Tuple[str, str]], name: str, default: str = '') -> str:
+    """Decode one raw header exactly as policy.default would"""
+    header = raw_headers.get(name)
+    if header is None:
+        return default
+    return str(policy.default.header_fetch_parse(*header))
+
+
+def _attachment_filename(part: Message) -> Optional[str]:
+    """An attachment's file name, decoded exactly as policy.default would"""
+    # Both policies store raw header values the same way, so the part only
+    # needs policy.default while its name is looked up
+    part.policy = policy.default
+    try:
+        return part.get_filename()
+    finally:
+        part.policy = policy.compat32
+
+
+def _read_header_block(eml_file: BinaryIO) -> bytes:
+    """Read a message's header lines, up to and including the blank line"""
+    lines = []
+    for line in eml_file:
+        lines.append(line)
+        if line in (b'\r\n', b'\n'):
+            break
+    return b''.join(lines)
+
+
+def _attachment_payload(part: Message) -> bytes:
+    """Decoded contents of an attachment part"""
+    if part.get('Content-Transfer-Encoding', '').strip().lower() == 'base64':
+        try:
+            # One C-level call over the whole payload; line breaks are
+            # skipped by the decoder rather than split off first
+            return base64.b64decode(part.get_payload())
+        except (binascii.Error, ValueError):
+            # Damaged base64 - let the email package salvage what it can
+            pass
+    return part.get_payload(decode=True) or b''
+
+
+def _intern_addresses(email_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Share one copy of each short from/to value across all emails"""
+    # Done in this process: strings unpickled from workers are fresh copies
+    for key in ('from', 'to'):
+        value = email_data.get(key)
+        if value and len(value) < MAX_INTERNED_LENGTH:
+            email_data[key] = sys.intern(value)
+    return email_data
+
+
+def _text_message(content: str, name: str) -> Optional[Dict[str, Any]]:
+    """A plain text file as a message, if it's long enough to be one"""
+    if len(content) <= 50:  # Reasonable email length
+        return None
+    return {
+        'subject': f'Message from {name}',
+        'from': '',
+        'to': '',
+        'cc': '',
+        'date': '',
+        'body': content,
+        'attachments': []
+    }
+
+
+def _is_skipped_name(name: str) -> bool:
+    """True for macOS metadata files that can never hold an email"""
+    return name in _SKIP_NAMES or name.startswith('._')
+
+
+def _entry_kind(name: str) -> Optional[str]:
+    """How a file is parsed, from its base name: 'eml', 'xml', 'txt' or None"""
+    name = name.lower()
+    if name.endswith('.eml'):
+        return 'eml'
+    if name.endswith('.xml'):
+        # Only message XML files hold emails
+        return 'xml' if 'message' in name else None
+    if name.endswith('.txt'):
+        return 'txt'
+    return None
+
+
+def _iter_files(root: Union[str, Path]) -> Iterator[Tuple[str, str]]:
+    """Walk a directory tree once, yielding (path, file name) per file"""
+    pending = [root]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.is_file() and not _is_skipped_name(entry.name):
+                    yield entry.path, entry.name
+
+
+@functools.lru_cache(maxsize=1024)
+def _xml_field(tag: str) -> Optional[str]:
+    """Email field an XML message tag holds, decided once per distinct tag"""
+    name = tag.rsplit('}', 1)[-1].lower()
+    if name == 'cc':
+        return 'cc'
+    # First keyword found in the tag name wins, e.g. OPFMessageCopySubject
+    for keyword in _XML_KEYWORDS:
+        if keyword in name:
+            return keyword
+    return None
+
+
+def _decode_undeclared(body: bytes, sender: str) -> str:
+    """Decode a body without a usable declared charset, detecting its encoding"""
+    domain = email.utils.parseaddr(sender)[1].rpartition('@')[2].lower()
+    key = (body[:DETECT_KEY_BYTES], domain)
+    with _detected_lock:
+        encoding = _detected_encodings.get(key)
+        if encoding is not None:
+            _detected_encodings.move_to_end(key)
+
+    if encoding is not None:
+        # The cached encoding was detected on another message, so it is only
+        # trusted if this body decodes cleanly with it
+        try:
+            return body.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+
+    # Detect from the start of the body only
+    encoding = chardet.detect(body[:DETECT_SAMPLE_BYTES])['encoding'] or 'utf-8'
+    # An ASCII result says nothing about the rest of the sender's mail
+    if encoding.lower() != 'ascii':
+        with _detected_lock:
+            _detected_encodings[key] = encoding
+            _detected_encodings.move_to_end(key)
+            if len(_detected_encodings) > DETECT_CACHE_SIZE:
+                _detected_encodings.popitem(last=False)
+    return body.decode(encoding, errors='ignore')
+
+
+def new_process_pool(max_workers: int) -> Optional[ProcessPoolExecutor]:
+    """
+    Start a process pool, or return None if processes aren't available
+
+    On POSIX the workers come from a forkserver rather than being forked
+    from the caller, which is usually a thread pool worker: forking a
+    multithreaded process can deadlock on locks held by other threads.
+    """
+    context = None
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+
+    try:
+        return ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+    except (OSError, NotImplementedError):
+        # Some serverless runtimes lack the semaphores multiprocessing needs
+        return None
+
+
+def _chunk_entries(entries: List[Tuple[str, zipfile.ZipInfo]]) -> Iterator[List[Tuple[str, zipfile.ZipInfo]]]:
+    """Split entries into runs of PARALLEL_CHUNK_SIZE, or less once PARALLEL_CHUNK_BYTES is reached"""
+    chunk = []
+    size = 0
+    for kind, info in entries:
+        chunk.append((kind, info))
+        size += info.file_size
+        if len(chunk) >= PARALLEL_CHUNK_SIZE or size >= PARALLEL_CHUNK_BYTES:
+            yield chunk
+            chunk = []
+            size = 0
+    if chunk:
+        yield chunk
+
+
+def _parse_chunk_in_worker(
+    options: Dict[str, Any],
+    chunk: List[Tuple[str, bytes]]
+) -> List[Tuple[Optional[Dict[str, Any]], Optional[str]]]:
+    """Parse a run of entry contents, returning (email_data, error message) for each"""
+    # Entries arrive as bytes, so the parser never opens an archive itself
+    parser = OLMParser('', **options)
+    results = []
+    for kind, data in chunk:
+        try:
+            results.append((parser._parse_entry((kind, io.BytesIO(data))), None))
+        except Exception as e:
+            results.append((None, str(e)))
+    return results
@@ -10,7 +10,7 @@ REM Check if Python is installed
 python --version >nul 2>&1
 if errorlevel 1 (
     echo Error: Python is not installed.
-    echo Please install Python 3.8 or higher.
+    echo Please install Python 3.10 or higher.
     pause
     exit /b 1
 )